@@ -1,85 +1,317 @@
 import os
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 import requests
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import appdirs
 from pathlib import Path
 
+from requests.adapters import HTTPAdapter
 from rich.progress import Progress
 
 APP_NAME = "BinanceCandleCache"
+KLINES_URL = "https://api.binance.com/api/v3/klines"
+PAGE_LIMIT = 1000
+MAX_WORKERS = 8
+WEIGHT_LIMIT = 1200
+WEIGHT_BACKOFF_THRESHOLD = 1000
+PARTITION_FILE = "part.parquet"
+CANDLE_COLUMNS = ["open", "high", "low", "close", "volume"]
+CANDLE_SCHEMA = pa.schema(
+    [("timestamp", pa.timestamp("ms", tz="UTC"))]
+    + [(column, pa.float64()) for column in CANDLE_COLUMNS]
+)
 
-def _timeframe_to_pandas_freq(tf_str):
-    """Converts a timeframe string like '3m' or '1h' to a pandas frequency string."""
-    if 'm' in tf_str:
-        return f"{int(tf_str.replace('m', ''))}min"
-    if 'h' in tf_str:
-        return tf_str
-    return None
+# Shared session so consecutive pages reuse the same keep-alive connection
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+
+# Monotonic time before which no worker may send a request, shared so a rate limit
+# response pauses every worker rather than only the one that received it
+_RATE_LIMIT_LOCK = threading.Lock()
+_resume_at = 0.0
+
+_TIMEFRAME_UNITS_MS = {
+    'm': 60_000,
+    'h': 3_600_000,
+    'd': 86_400_000,
+}
+
+@lru_cache(maxsize=None)
+def _timeframe_to_ms(tf_str: str) -> int:
+    """Converts a timeframe string like '3m' or '1h' to its candle length in milliseconds."""
+    unit, count = tf_str[-1:], tf_str[:-1]
+    if unit not in _TIMEFRAME_UNITS_MS or not count.isdigit():
+        raise ValueError(f"Unsupported timeframe: {tf_str!r}")
+
+    return int(count) * _TIMEFRAME_UNITS_MS[unit]
+
+def _pause_requests(seconds: float) -> None:
+    """Holds back every download worker for the given number of seconds."""
+    global _resume_at
+    with _RATE_LIMIT_LOCK:
+        _resume_at = max(_resume_at, time.monotonic() + seconds)
+
+def _wait_for_rate_limit() -> None:
+    """Blocks until any pause requested through _pause_requests has elapsed."""
+    with _RATE_LIMIT_LOCK:
+        delay = _resume_at - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def _page_to_arrays(data: list) -> tuple[np.ndarray, np.ndarray]:
+    """Converts a raw klines page to int64 open times and an (n, 5) float64 OHLCV array."""
+    if not data:
+        return np.empty(0, dtype=np.int64), np.empty((0, len(CANDLE_COLUMNS)))
+
+    arr = np.asarray(data, dtype=object)
+    return arr[:, 0].astype(np.int64), arr[:, 1:6].astype(np.float64)
+
+def _fetch_page(
+    symbol: str, timeframe: str, start_ms: int, end_ms: int
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Fetches a single page of up to PAGE_LIMIT candles opened between start_ms and end_ms.
+
+    Decoding and array conversion happen here, on the worker thread, so they overlap
+    with other pages still in flight.
+    """
+    params = {
+        "symbol": symbol,
+        "interval": timeframe,
+        "startTime": start_ms,
+        "endTime": end_ms,
+        "limit": PAGE_LIMIT,
+    }
+    while True:
+        _wait_for_rate_limit()
+        response = _SESSION.get(KLINES_URL, params=params, timeout=10)
+        if response.status_code != 429:
+            break
+        _pause_requests(int(response.headers.get("Retry-After", 60)))
+
+    # 418 means the IP is already banned; retrying would only extend the ban
+    if response.status_code != 200:
+        return None
+
+    # Back off proportionally once the used request weight nears the per-minute limit
+    used_weight = int(response.headers.get("X-MBX-USED-WEIGHT-1M", 0))
+    if used_weight > WEIGHT_BACKOFF_THRESHOLD:
+        excess = used_weight - WEIGHT_BACKOFF_THRESHOLD
+        _pause_requests(excess * 60 / (WEIGHT_LIMIT - WEIGHT_BACKOFF_THRESHOLD))
+
+    return _page_to_arrays(orjson.loads(response.content))
+
+def _candles_to_table(timestamps: np.ndarray, ohlcv: np.ndarray) -> pa.Table:
+    """Builds a table in the cache schema from int64 ms open times and an (n, 5) float64 OHLCV array."""
+    columns = [pa.array(timestamps, type=CANDLE_SCHEMA.field('timestamp').type)]
+    columns += [pa.array(ohlcv[:, i]) for i in range(len(CANDLE_COLUMNS))]
+    return pa.Table.from_arrays(columns, schema=CANDLE_SCHEMA)
+
+def _scatter_page(
+    ohlcv: np.ndarray, expected_ms: np.ndarray, interval_ms: int, timestamps: np.ndarray, page_ohlcv: np.ndarray
+) -> np.ndarray:
+    """Writes a page's candles into their rows of ohlcv, skipping any not in expected_ms, and returns the rows written."""
+    pos = (timestamps - expected_ms[0]) // interval_ms
+    keep = (pos >= 0) & (pos < len(expected_ms))
+    # Off-grid open times would otherwise land on (and overwrite) a neighbouring row
+    keep[keep] = expected_ms[pos[keep]] == timestamps[keep]
+    pos = pos[keep]
+    ohlcv[pos] = page_ohlcv[keep]
+    return pos
 
 def _download_candlestick_data(
     symbol: str,
     timeframe: str,
-    start_time: pd.Timestamp,
-    end_time: pd.Timestamp
-) -> pd.DataFrame:
+    expected_ms: np.ndarray
+) -> pa.Table | None:
     """
     Downloads candlestick data from Binance API.
 
     Args:
         symbol (str): Trading pair symbol (e.g., 'BTCUSDT').
         timeframe (str): Timeframe string (e.g., '1m', '5m', '1h').
-        start_time (pd.Timestamp): Start time for fetching data.
-        end_time (pd.Timestamp): End time for fetching data.
+        expected_ms (np.ndarray): Contiguous candle open times to fetch, in epoch milliseconds.
 
     Returns:
-        pd.DataFrame: DataFrame containing the downloaded candlestick data with forward-filled missing values.
+        pa.Table: Table containing the downloaded candlestick data with forward-filled missing values.
     """
-    all_candles = []
+    start_ms = int(expected_ms[0])
+    # Candles that have not opened yet cannot be downloaded
+    end_ms = min(int(expected_ms[-1]), int(time.time() * 1000))
+    interval_ms = _timeframe_to_ms(timeframe)
+    total_candles = len(expected_ms)
 
-    start_ms = int(start_time.tz_convert("UTC").timestamp() * 1000)
-    end_ms = int(end_time.tz_convert("UTC").timestamp() * 1000)
-    total_candles = pd.date_range(start=start_time, end=end_time, freq=_timeframe_to_pandas_freq(timeframe), tz='UTC').size
-    current_fetch_start = start_ms # This will be updated as we get more and more candles
+    # Candle times are known up front, so each row is written straight to its slot;
+    # slots that stay NaN are candles the exchange did not return
+    ohlcv = np.full((total_candles, len(CANDLE_COLUMNS)), np.nan)
+    first, last = total_candles, -1
+
+    if end_ms < start_ms:
+        return None
 
     with Progress() as progress:
         task = progress.add_task("Downloading candles...", total=total_candles)
 
-        while True:
-            url = f"https://api.binance.com/api/v3/klines?symbol={symbol}&interval={timeframe}&startTime={current_fetch_start}&limit=1000"
-            response = requests.get(url)
-
-            if response.status_code == 200:
-                data = response.json()
-                if not data:
-                    break
+        # The first page is fetched on its own: Binance returns candles from the first one
+        # available in the range, so for a start before the listing date it tells us where
+        # the data actually begins, and an empty reply means there is none in range
+        page = _fetch_page(symbol, timeframe, start_ms, end_ms)
+        if page is None:
+            return None
 
-                new_candles = [candle for candle in data if candle[0] <= end_ms]
-                all_candles.extend(new_candles)
+        timestamps, page_ohlcv = page
+        if not len(timestamps):
+            return None
 
-                if not new_candles or data[-1][0] > end_ms:
-                    break
+        pos = _scatter_page(ohlcv, expected_ms, interval_ms, timestamps, page_ohlcv)
+        if len(pos):
+            first, last = pos[0], pos[-1]
+        progress.update(task, advance=(int(timestamps[0]) - start_ms) // interval_ms + len(pos))
 
-                current_fetch_start = new_candles[-1][0] + 1
-                progress.update(task, advance=len(new_candles))
-                time.sleep(0.2)
-            else:
-                return None
+        # Remaining page boundaries are then known up front, so they can be requested concurrently
+        page_span = PAGE_LIMIT * interval_ms
+        next_start = int(timestamps[-1]) + interval_ms if len(timestamps) == PAGE_LIMIT else end_ms + 1
+        executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        try:
+            futures = [
+                executor.submit(_fetch_page, symbol, timeframe, page_start, min(page_start + page_span - 1, end_ms))
+                for page_start in range(next_start, end_ms + 1, page_span)
+            ]
 
-    if all_candles:
-        ohlc_data = [candle[:6] for candle in all_candles]
-        new_df = pd.DataFrame(ohlc_data, columns=["timestamp", "open", "high", "low", "close", "volume"])
-        new_df['timestamp'] = pd.to_datetime(new_df['timestamp'], unit='ms').dt.tz_localize('UTC')
-        new_df.set_index('timestamp', inplace=True)
+            for future in as_completed(futures):
+                page = future.result()
+                if page is None:
+                    return None
 
-        numeric_cols = ["open", "high", "low", "close", "volume"]
-        new_df[numeric_cols] = new_df[numeric_cols].apply(pd.to_numeric, errors='coerce')
+                timestamps, page_ohlcv = page
+                pos = _scatter_page(ohlcv, expected_ms, interval_ms, timestamps, page_ohlcv)
+                if len(pos):
+                    first, last = min(first, pos[0]), max(last, pos[-1])
+                progress.update(task, advance=len(pos))
+        finally:
+            # Drop queued pages on any early exit (failed page, exception, Ctrl-C) instead of waiting for them
+            executor.shutdown(wait=False, cancel_futures=True)
 
+    if last >= 0:
         # Fill missing candles with previous OHLC
-        new_df = new_df.asfreq(_timeframe_to_pandas_freq(timeframe), method='ffill')
+        values = ohlcv[first:last + 1]
+        fill_idx = np.where(np.isnan(values[:, 0]), 0, np.arange(len(values)))
+        np.maximum.accumulate(fill_idx, out=fill_idx)
+
+        return _candles_to_table(expected_ms[first:last + 1], values[fill_idx])
+
+def _to_ms(ts: pd.Timestamp) -> int:
+    """Converts a timestamp to epoch milliseconds, treating naive timestamps as UTC."""
+    return pd.Timestamp(ts).value // 1_000_000
+
+def _table_to_frame(table: pa.Table) -> pd.DataFrame:
+    """Converts a table in the cache schema to a DataFrame indexed by timestamp."""
+    return table.to_pandas(split_blocks=True).set_index('timestamp')
+
+@lru_cache(maxsize=64)
+def _load_partition(path: Path, mtime_ns: int) -> pa.Table:
+    """Loads a cached partition file. mtime_ns is part of the cache key so rewritten files are reloaded."""
+    return pq.read_table(path, columns=CANDLE_SCHEMA.names).cast(CANDLE_SCHEMA)
+
+def _read_cache(cache_root: Path, start_ms: int, end_ms: int) -> pa.Table:
+    """
+    Reads cached candles in [start_ms, end_ms] from a partitioned Parquet dataset.
+
+    Only the year/month partitions overlapping the range are loaded, and loaded
+    partitions are kept in memory until their file changes.
+
+    Args:
+        cache_root (Path): Root directory of the symbol/timeframe dataset.
+        start_ms (int): Start of the requested range in epoch milliseconds.
+        end_ms (int): End of the requested range in epoch milliseconds.
+
+    Returns:
+        pa.Table: Cached candles within the range, sorted by timestamp.
+    """
+    if not cache_root.exists():
+        return CANDLE_SCHEMA.empty_table()
+
+    # Months since the epoch, matching the year=/month= partition names
+    first_month, last_month = np.array([start_ms, end_ms], dtype='datetime64[ms]').astype('datetime64[M]').astype(np.int64)
+
+    partitions = []
+    for part_dir in cache_root.glob("year=*/month=*"):
+        year = int(part_dir.parent.name.split('=')[1])
+        month = (year - 1970) * 12 + int(part_dir.name.split('=')[1]) - 1
+        if first_month <= month <= last_month:
+            partitions.append((month, part_dir))
+
+    tables = [
+        _load_partition(path, path.stat().st_mtime_ns)
+        for _, part_dir in sorted(partitions)
+        if (path := part_dir / PARTITION_FILE).exists()
+    ]
+    table = pa.concat_tables(tables) if tables else CANDLE_SCHEMA.empty_table()
+
+    timestamps = table['timestamp'].to_numpy().astype(np.int64)
+    lo = np.searchsorted(timestamps, start_ms, side='left')
+    hi = np.searchsorted(timestamps, end_ms, side='right')
+    return table.slice(lo, hi - lo)
+
+def _write_cache(cache_root: Path, new_data: pa.Table) -> None:
+    """
+    Appends candles to a dataset partitioned by year and month.
+
+    Only the partitions touched by new_data are read back, merged and rewritten;
+    the rest of the dataset is left untouched.
+
+    Args:
+        cache_root (Path): Root directory of the symbol/timeframe dataset.
+        new_data (pa.Table): Contiguous, sorted candles to add, in the cache schema.
+    """
+    months = new_data['timestamp'].to_numpy().astype('datetime64[M]')
+    month_values, offsets = np.unique(months, return_index=True)
+    bounds = np.r_[offsets, len(months)]
+
+    for month_value, start, stop in zip(month_values, bounds[:-1], bounds[1:]):
+        year, month = divmod(int(month_value.astype(np.int64)), 12)
+        part_dir = cache_root / f"year={year + 1970}" / f"month={month + 1}"
+        part_dir.mkdir(parents=True, exist_ok=True)
+        part = new_data.slice(start, stop - start)
+
+        part_path = part_dir / PARTITION_FILE
+        if part_path.exists():
+            existing = _load_partition(part_path, part_path.stat().st_mtime_ns)
+            existing_ts = existing['timestamp'].to_numpy().astype(np.int64)
+
+            # New candles are one contiguous run: they replace whatever the cache holds in
+            # that span and are spliced in between the older and newer cached rows
+            lo = np.searchsorted(existing_ts, part['timestamp'][0].value, side='left')
+            hi = np.searchsorted(existing_ts, part['timestamp'][-1].value, side='right')
+            part = pa.concat_tables([existing.slice(0, lo), part, existing.slice(hi)])
+
+        # Write to a temporary file and swap it in, so a partition is always exactly one
+        # complete, sorted file even if the process dies mid-write
+        fd, tmp_name = tempfile.mkstemp(dir=part_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(
+                part,
+                tmp_name,
+                # Fixed-stride timestamps delta-encode to a few bits per value
+                use_dictionary=CANDLE_COLUMNS,
+                column_encoding={'timestamp': 'DELTA_BINARY_PACKED'},
+                compression='zstd',
+                compression_level=3,
+            )
+            os.replace(tmp_name, part_path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
 
-        return new_df
-    
 def fetch_candlestick_data(
     symbol: str,
     timeframe: str,
@@ -101,50 +333,36 @@ def fetch_candlestick_data(
     cache_dir = Path(appdirs.user_cache_dir(APP_NAME))
     cache_dir.mkdir(parents=True, exist_ok=True)
 
-    file_name = f"{symbol}_{timeframe}.parquet"
-    cache_file = cache_dir / file_name
-
-    print(f"Using cache file at: {cache_file}")
-
-    if cache_file.exists():
-        main_cache = pd.read_parquet(cache_file)
-
-        # Extract requested range
-        requested_data = main_cache[(main_cache.index >= start_time) & (main_cache.index <= end_time)]
-
-        # Check if we have all requested data
-        requested_range = pd.date_range(start=start_time, end=end_time, freq=_timeframe_to_pandas_freq(timeframe), tz='UTC')
-        missing_timestamps = requested_range.difference(requested_data.index)
-
-        if missing_timestamps.empty:
-            return requested_data
-        else:
-            # Fetch missing data
-            gaps = []
-            if not missing_timestamps.empty:
-                start_gap = missing_timestamps[0]
-                end_gap = missing_timestamps[0]
-                for i in range(1, len(missing_timestamps)):
-                    if missing_timestamps[i] == end_gap + pd.Timedelta(_timeframe_to_pandas_freq(timeframe)):
-                        end_gap = missing_timestamps[i]
-                    else:
-                        gaps.append((start_gap, end_gap))
-                        start_gap = missing_timestamps[i]
-                        end_gap = missing_timestamps[i]
-                gaps.append((start_gap, end_gap))
-
-            for start_gap, end_gap in gaps:
-                new_data = _download_candlestick_data(symbol, timeframe, start_gap, end_gap)
-                if new_data is not None:
-                    main_cache = pd.concat([main_cache, new_data]).sort_index().drop_duplicates()
-
-            main_cache.to_parquet(cache_file)
-            return main_cache[(main_cache.index >= start_time) & (main_cache.index <= end_time)]
-    else:
-        # Cache does not exist, download all data
-        new_data = _download_candlestick_data(symbol, timeframe, start_time, end_time)
+    cache_root = cache_dir / f"{symbol}_{timeframe}"
+
+    print(f"Using cache directory at: {cache_root}")
+
+    # All index math is done on int64 epoch milliseconds; the UTC timezone is only
+    # attached when the result is converted to a DataFrame
+    interval_ms = _timeframe_to_ms(timeframe)
+    start_ms = -(-_to_ms(start_time) // interval_ms) * interval_ms
+    end_ms = _to_ms(end_time)
+
+    # Extract requested range
+    requested_data = _read_cache(cache_root, start_ms, end_ms)
+
+    # Check if we have all requested data
+    requested_ms = np.arange(start_ms, end_ms + 1, interval_ms, dtype=np.int64)
+    cached_ms = requested_data['timestamp'].to_numpy().astype(np.int64)
+    missing_ms = np.setdiff1d(requested_ms, cached_ms, assume_unique=True)
+
+    if not len(missing_ms):
+        return _table_to_frame(requested_data)
+
+    # Fetch missing data, coalescing consecutive timestamps into gaps
+    breaks = np.flatnonzero(np.diff(missing_ms) != interval_ms) + 1
+    starts = np.r_[0, breaks]
+    ends = np.r_[breaks - 1, len(missing_ms) - 1]
+    gaps = [missing_ms[start:end + 1] for start, end in zip(starts, ends)]
+
+    for gap in gaps:
+        new_data = _download_candlestick_data(symbol, timeframe, gap)
         if new_data is not None:
-            new_data.to_parquet(cache_file)
-            return new_data
-        else:
-            return pd.DataFrame()
\ No newline at end of file
+            _write_cache(cache_root, new_data)
+
+    return _table_to_frame(_read_cache(cache_root, start_ms, end_ms))